@@ -7,40 +7,94 @@ import time
 from habanero import Crossref # Import habanero
 import os
 import logging
+from logging.handlers import MemoryHandler
 import re
+import shelve
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 INPUT_CSV = 'merged_papers.csv'
 ORIG_WOS_XLS = 'WebOfScience.xls'
 ORIG_PSYC_XLS = 'PsycInfo.xls'
+# Parquet snapshots of the original XLS files; reloading these takes tens of
+# ms where pd.read_excel takes seconds, so reruns skip the slow parse
+WOS_PARQUET = '.wos.parquet'
+PSYC_PARQUET = '.psyc.parquet'
+# Only the original XLS columns actually consulted downstream (lookup keys +
+# template fields); passed as a usecols filter so unused columns are never parsed
+WOS_ORIG_COLS = {'Authors', 'Author', 'Article Title', 'Title', 'Source Title', 'Journal',
+                 'Publication Year', 'Year', 'DOI', 'Volume', 'Issue', 'Pages', 'Abstract'}
+PSYC_ORIG_COLS = {'Authors', 'Author', 'title', 'Title', 'source', 'Source Title', 'Journal',
+                  'publicationDate', 'Year', 'doi', 'DOI', 'Volume', 'Issue', 'Pages', 'Abstract'}
 LOG_FILE = 'zotero_import_log_v4.txt' # New log file for this version
 
 # === Configuration and Constants === #
-rate_limit_delay = 15  # Seconds to wait if hit by rate limit
+rate_limit_delay = 15  # Fallback wait if throttled without a Retry-After header
+MIN_CALL_INTERVAL = 0.2  # Target spacing between per-paper API calls (seconds)
+# Identify ourselves to Crossref so requests are routed to the "polite" pool,
+# which has higher rate limits and lower latency than the anonymous public pool.
+CROSSREF_MAILTO = 'actonbp@users.noreply.github.com'
+CROSSREF_UA = 'lead_identity_meta/1.0'
 
 # === Setup Logging === #
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO, 
-                   format='%(asctime)s - %(message)s', 
-                   datefmt='%Y-%m-%d %H:%M:%S')
-
-def log_message(message):
-    """Log a message to both the log file and console"""
-    print(message)
-    logging.info(message)
+# The file handler sits behind a memory buffer so the hot loop is not paying a
+# disk flush per log line; the buffer drains every 200 records, on any ERROR,
+# and at shutdown. The console only echoes INFO and above.
+logger = logging.getLogger('zotero_import')
+logger.setLevel(logging.DEBUG)
+_file_handler = logging.FileHandler(LOG_FILE, encoding='utf-8', delay=True)
+_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s',
+                                             datefmt='%Y-%m-%d %H:%M:%S'))
+_buffer_handler = MemoryHandler(capacity=200, flushLevel=logging.ERROR, target=_file_handler)
+logger.addHandler(_buffer_handler)
+
+def log_message(message, level=logging.INFO):
+    """Log a message to the buffered log file; INFO and above also print"""
+    if level >= logging.INFO:
+        print(message)
+    logger.log(level, message)
+
+# --- Helper: Rate limiting --- #
+def backoff_delay(e):
+    """Seconds to wait after a throttled call: the server's Retry-After if given."""
+    response = getattr(e, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return rate_limit_delay
+
+_last_api_call = 0.0
+
+def throttle():
+    """Sleep only as long as needed to keep calls ~MIN_CALL_INTERVAL apart."""
+    global _last_api_call
+    elapsed = time.monotonic() - _last_api_call
+    if elapsed < MIN_CALL_INTERVAL:
+        time.sleep(MIN_CALL_INTERVAL - elapsed)
+    _last_api_call = time.monotonic()
+
+# Compiled once at module scope; these run per row in the hot loop
+_HTML_RE = re.compile(r'<[^<]+?>')
+_YEAR_RE = re.compile(r'\d{4}')
 
 # --- Helper: Standardization functions (needed to match merged keys to original data) ---
-def standardize_text(text):
-    if isinstance(text, pd.Series):
-        return text.astype(str).str.lower().str.strip().replace('nan', np.nan)
-    elif pd.isna(text) or text is None:
+# Split into scalar/Series variants so per-row calls skip the isinstance branch
+def standardize_text_series(series):
+    return series.astype(str).str.lower().str.strip().replace('nan', np.nan)
+
+def standardize_text_scalar(text):
+    if pd.isna(text) or text is None:
         return ''
-    else:
-        return str(text).lower().strip()
+    return str(text).lower().strip()
 
 def standardize_year(year):
     if pd.isna(year) or year is None:
         return ''
     # Extract first 4-digit number from the string
-    match = re.search(r'\d{4}', str(year))
+    match = _YEAR_RE.search(str(year))
     if match:
         return match.group(0)
     return str(year).strip()
@@ -49,24 +103,35 @@ def standardize_year_wos(series):
     return pd.to_numeric(series, errors='coerce').astype('Int64')
 
 def standardize_year_psyc(series):
-    return pd.to_numeric(series.astype(str).str[:4], errors='coerce').astype('Int64')
+    # One vectorized regex extract of the 4-digit year instead of per-row parsing
+    return pd.to_numeric(series.astype(str).str.extract(r'(\d{4})', expand=False), errors='coerce').astype('Int64')
+
+# --- Helper: Build Hash Indexes for Original Records --- #
+def build_lookup_index(series):
+    """Map each non-null value to the positional index of its first occurrence."""
+    index = {}
+    for i, value in enumerate(series):
+        if pd.notna(value) and value not in index:
+            index[value] = i
+    return index
 
 # --- Helper: Find Original Record --- #
-def find_original_record(doi_std, title_std, author_std, year_std, wos_orig_lookup, psyc_orig_lookup):
-    # Prioritize DOI match if available
+def find_original_record(doi_std, title_std, author_std, year_std, wos_lookup, psyc_lookup):
+    # Prioritize DOI match if available. Membership is a C-level hash test on
+    # the index dicts (their key views behave as sets), never a column scan.
     if pd.notna(doi_std):
-        if doi_std in wos_orig_lookup['DOI_std'].values:
-            return wos_orig_lookup[wos_orig_lookup['DOI_std'] == doi_std].iloc[0], 'WOS'
-        if doi_std in psyc_orig_lookup['DOI_std'].values:
-            return psyc_orig_lookup[psyc_orig_lookup['DOI_std'] == doi_std].iloc[0], 'PsycInfo'
+        if doi_std in wos_lookup['by_doi']:
+            return wos_lookup['df'].iloc[wos_lookup['by_doi'][doi_std]], 'WOS'
+        if doi_std in psyc_lookup['by_doi']:
+            return psyc_lookup['df'].iloc[psyc_lookup['by_doi'][doi_std]], 'PsycInfo'
 
     # Fallback to Title/Author/Year match
-    secondary_key = f"{title_std or ''}|{author_std or ''}|{year_std or ''}"
     if pd.notna(title_std) and pd.notna(author_std) and pd.notna(year_std):
-        if secondary_key in wos_orig_lookup['Secondary_Key'].values:
-            return wos_orig_lookup[wos_orig_lookup['Secondary_Key'] == secondary_key].iloc[0], 'WOS'
-        if secondary_key in psyc_orig_lookup['Secondary_Key'].values:
-            return psyc_orig_lookup[psyc_orig_lookup['Secondary_Key'] == secondary_key].iloc[0], 'PsycInfo'
+        secondary_key = f"{title_std or ''}|{author_std or ''}|{year_std or ''}"
+        if secondary_key in wos_lookup['by_key']:
+            return wos_lookup['df'].iloc[wos_lookup['by_key'][secondary_key]], 'WOS'
+        if secondary_key in psyc_lookup['by_key']:
+            return psyc_lookup['df'].iloc[psyc_lookup['by_key'][secondary_key]], 'PsycInfo'
 
     log_message(f"  WARNING: Could not find original record for DOI: {doi_std} / Title: {title_std:.30}")
     return None, None
@@ -119,7 +184,7 @@ def create_template_from_crossref(cr_data, collection_id=None):
         template['DOI'] = cr_data['DOI']
     
     if cr_data.get('abstract'):
-        abstract_text = re.sub('<[^<]+?>', '', cr_data['abstract'])
+        abstract_text = _HTML_RE.sub('', cr_data['abstract'])
         template['abstractNote'] = abstract_text.strip()
 
     # Add collection if provided
@@ -131,10 +196,20 @@ def create_template_from_crossref(cr_data, collection_id=None):
     return template
 
 # --- Helper: Create Zotero Template from Original Data --- #
+# Zotero field -> candidate source columns; the first with a value wins
+_FIELD_MAP = {
+    'publicationTitle': ('Journal', 'Source Title'),
+    'volume': ('Volume',),
+    'issue': ('Issue',),
+    'pages': ('Pages',),
+    'DOI': ('DOI',),
+    'abstractNote': ('Abstract',),
+}
+
 def create_template_from_original(original_row, source_db, collection_id=None):
     template = {
         'itemType': 'journalArticle',
-        'title': standardize_text(original_row.get('Title', '')),
+        'title': standardize_text_scalar(original_row.get('Title', '')),
         'creators': []
     }
     
@@ -189,29 +264,17 @@ def create_template_from_original(original_row, source_db, collection_id=None):
                         'firstName': ''
                     })
     
-    # Map other fields
-    journal_field = 'Journal' if 'Journal' in original_row else 'Source Title' if 'Source Title' in original_row else None
-    if journal_field and not pd.isna(original_row.get(journal_field)):
-        template['publicationTitle'] = standardize_text(original_row[journal_field])
-    
+    # Map other fields: first candidate column with a value wins
+    for zotero_key, candidates in _FIELD_MAP.items():
+        for col in candidates:
+            value = original_row.get(col)
+            if value is not None and not pd.isna(value):
+                template[zotero_key] = standardize_text_scalar(value)
+                break
+
     if 'Year' in original_row and not pd.isna(original_row['Year']):
         template['date'] = standardize_year(original_row['Year'])
-    
-    if 'Volume' in original_row and not pd.isna(original_row['Volume']):
-        template['volume'] = standardize_text(original_row['Volume'])
-    
-    if 'Issue' in original_row and not pd.isna(original_row['Issue']):
-        template['issue'] = standardize_text(original_row['Issue'])
-    
-    if 'Pages' in original_row and not pd.isna(original_row['Pages']):
-        template['pages'] = standardize_text(original_row['Pages'])
-    
-    if 'DOI' in original_row and not pd.isna(original_row['DOI']):
-        template['DOI'] = standardize_text(original_row['DOI'])
-    
-    if 'Abstract' in original_row and not pd.isna(original_row['Abstract']):
-        template['abstractNote'] = standardize_text(original_row['Abstract'])
-    
+
     # Ensure required fields have values
     for key in ['title', 'publicationTitle', 'date', 'DOI']:
         if not template.get(key):
@@ -225,38 +288,54 @@ def create_template_from_original(original_row, source_db, collection_id=None):
 
     return template
 
-# --- Helper: Add Existing Item to Collection --- #
-def add_existing_item_to_collection(zot_client, item_key, collection_id, collection_name):
+# --- Helper: Add Existing Items to Collection (batched) --- #
+# Item keys are buffered and flushed in batches: one GET for up to 50 items
+# plus one multi-item write, instead of a GET + PUT round-trip per item.
+COLLECTION_ADD_BATCH_SIZE = 50
+pending_collection_adds = []
+
+def queue_collection_add(zot_client, item_key, collection_id, collection_name):
     if not collection_id or not item_key:
         log_message(f"  Skipping add to collection: Missing item_key ({item_key}) or collection_id ({collection_id})")
         return
+    pending_collection_adds.append(item_key)
+    if len(pending_collection_adds) >= COLLECTION_ADD_BATCH_SIZE:
+        flush_collection_adds(zot_client, collection_id, collection_name)
 
-    log_message(f"  Checking/adding existing Item Key {item_key} to Collection ID {collection_id} ('{collection_name}').")
+def flush_collection_adds(zot_client, collection_id, collection_name):
+    if not pending_collection_adds:
+        return
+    batch_keys = pending_collection_adds[:]
+    del pending_collection_adds[:]
+
+    log_message(f"  Checking/adding {len(batch_keys)} existing items to Collection ID {collection_id} ('{collection_name}').")
     try:
-        item_data = zot_client.item(item_key) # Fetch current item data
-        if not item_data:
-            log_message(f"    ERROR: Could not fetch data for existing item key {item_key}.")
+        items = zot_client.items(itemKey=','.join(batch_keys))
+        if not items:
+            log_message(f"    ERROR: Could not fetch data for existing item keys {batch_keys}.")
             return
 
-        current_collections = item_data['data'].get('collections', [])
-        if collection_id not in current_collections:
-            log_message(f"    Item not in collection, attempting to add.")
-            updated_collections = current_collections + [collection_id]
-            update_payload = {'collections': updated_collections}
-            # Get current version for update
-            item_version = item_data['data']['version']
-            zot_client.update_item(item_key, update_payload, version=item_version)
-            log_message(f"    Successfully added existing item {item_key} to collection '{collection_name}'.")
+        items_to_update = []
+        for item_data in items:
+            current_collections = item_data['data'].get('collections', [])
+            if collection_id not in current_collections:
+                item_data['data']['collections'] = current_collections + [collection_id]
+                items_to_update.append(item_data['data'])
+
+        if items_to_update:
+            zot_client.update_items(items_to_update)
+            log_message(f"    Successfully added {len(items_to_update)} existing items to collection '{collection_name}'.")
         else:
-            log_message(f"    Item {item_key} already in collection '{collection_name}'.")
+            log_message(f"    All {len(items)} items already in collection '{collection_name}'.")
 
     except Exception as e:
-         log_message(f"    ERROR: Exception adding existing item {item_key} to collection {collection_id}. Error: {e}")
+         log_message(f"    ERROR: Exception adding existing items to collection {collection_id}. Error: {e}")
          import traceback
          log_message(traceback.format_exc())
          if "Rate limit" in str(e):
-             log_message(f"    WARNING: Hit Zotero API rate limit checking/adding existing item to collection. Waiting {rate_limit_delay}s.")
-             time.sleep(rate_limit_delay)
+             delay = backoff_delay(e)
+             log_message(f"    WARNING: Hit Zotero API rate limit checking/adding existing items to collection. Waiting {delay}s.")
+             time.sleep(delay)
 
 # === Main Script Logic ===
 
@@ -285,21 +364,20 @@ if not api_key or len(api_key) < 10:  # Basic validation
 library_type = 'user'
 log_message(f"Connecting to Zotero library ID {library_id}...")
 
-try:
-    zot = zotero.Zotero(library_id, library_type, api_key)
-    # Test the connection with a simple call
-    zot.collections(limit=1)
-    log_message("Successfully connected to Zotero.")
-except Exception as e:
-    log_message(f"Error connecting to Zotero: {e}")
-    sys.exit(1)
+zot = zotero.Zotero(library_id, library_type, api_key)
 
 # --- Get or Create Collection ---
 collection_name = input(f"Enter the name for the Zotero collection (e.g., Leadership Identity Meta-Analysis): ").strip()
 if not collection_name:
     collection_name = "Meta-Analysis Import"
     log_message(f"No collection name entered, using default: '{collection_name}'")
-collections = zot.collections()
+try:
+    # The collection listing we need anyway doubles as the connection test
+    collections = zot.collections()
+    log_message("Successfully connected to Zotero.")
+except Exception as e:
+    log_message(f"Error connecting to Zotero: {e}")
+    sys.exit(1)
 collection_id = None
 for coll in collections:
     if coll['data']['name'] == collection_name:
@@ -322,6 +400,20 @@ if collection_id is None:
 if collection_id is None:
     log_message("Could not find or create the target collection. Items will be added to the main library.")
 
+# --- Fetch DOIs Already in the Target Collection --- #
+# One paginated GET up front lets the main loop skip papers that were already
+# imported, instead of running the full strategy pipeline per duplicate.
+existing_dois = set()
+if collection_id:
+    log_message(f"Fetching existing items in collection '{collection_name}'...")
+    try:
+        existing_items = zot.everything(zot.collection_items(collection_id))
+        existing_dois = {str(itm['data']['DOI']).lower().strip()
+                         for itm in existing_items if itm.get('data', {}).get('DOI')}
+        log_message(f"Found {len(existing_dois)} DOIs already present in the collection.")
+    except Exception as e:
+        log_message(f"WARNING: Could not fetch existing collection items: {e}")
+
 # --- Load Data --- #
 log_message(f"Loading deduplicated list from {INPUT_CSV}...")
 try:
@@ -331,10 +423,33 @@ except FileNotFoundError:
     log_message(f"Error: Deduplicated file '{INPUT_CSV}' not found.")
     sys.exit(1)
 
+# Normalize DOIs once and drop rows that only differ by DOI case/whitespace,
+# so each unique DOI is fetched from Crossref (and pushed to Zotero) exactly
+# once. Rows without a DOI are always kept.
+dedup_df['DOI'] = dedup_df['DOI'].str.lower().str.strip()
+doi_dupes = dedup_df['DOI'].notna() & dedup_df.duplicated(subset='DOI', keep='first')
+if doi_dupes.any():
+    log_message(f"Dropping {int(doi_dupes.sum())} rows with duplicate DOIs after normalization.")
+    dedup_df = dedup_df[~doi_dupes].reset_index(drop=True)
+
+def load_original_data(xls_path, parquet_path, usecols, dtype):
+    """Load an original export, preferring its parquet snapshot when current."""
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(xls_path):
+        return pd.read_parquet(parquet_path)
+    df = pd.read_excel(xls_path, usecols=lambda c: c in usecols, dtype=dtype)
+    try:
+        df.to_parquet(parquet_path)
+    except Exception as e:
+        # Snapshot is an optimization only; fall back to XLS parsing next run
+        log_message(f"WARNING: Could not write parquet snapshot {parquet_path}: {e}")
+    return df
+
 log_message(f"Loading original data from {ORIG_WOS_XLS} and {ORIG_PSYC_XLS}...")
 try:
-    wos_orig_df = pd.read_excel(ORIG_WOS_XLS)
-    psyc_orig_df = pd.read_excel(ORIG_PSYC_XLS)
+    wos_orig_df = load_original_data(ORIG_WOS_XLS, WOS_PARQUET, WOS_ORIG_COLS,
+                                     {'DOI': str, 'Article Title': str, 'Authors': str})
+    psyc_orig_df = load_original_data(ORIG_PSYC_XLS, PSYC_PARQUET, PSYC_ORIG_COLS,
+                                      {'doi': str, 'title': str, 'Authors': str, 'publicationDate': str})
     log_message("Original data loaded successfully.")
 except FileNotFoundError:
     log_message(f"Error: Original XLS file(s) not found.")
@@ -343,30 +458,146 @@ except FileNotFoundError:
 # --- Pre-process Original Data for Lookup --- #
 log_message("Preprocessing original data for lookups...")
 # WOS
-wos_orig_df['DOI_std'] = standardize_text(wos_orig_df['DOI'])
-wos_orig_df['Title_std'] = standardize_text(wos_orig_df['Article Title'])
-wos_orig_df['Authors_std'] = standardize_text(wos_orig_df['Authors'])
+wos_orig_df['DOI_std'] = standardize_text_series(wos_orig_df['DOI'])
+wos_orig_df['Title_std'] = standardize_text_series(wos_orig_df['Article Title'])
+wos_orig_df['Authors_std'] = standardize_text_series(wos_orig_df['Authors'])
 wos_orig_df['Year_std'] = standardize_year_wos(wos_orig_df['Publication Year'])
-wos_orig_df['Secondary_Key'] = wos_orig_df['Title_std'].fillna('') + '|' + wos_orig_df['Authors_std'].fillna('') + '|' + wos_orig_df['Year_std'].astype(str).fillna('')
+wos_orig_df['Secondary_Key'] = wos_orig_df['Title_std'].str.cat(
+    [wos_orig_df['Authors_std'], wos_orig_df['Year_std'].astype('string')], sep='|', na_rep='')
 
 # PsycInfo
-psyc_orig_df['DOI_std'] = standardize_text(psyc_orig_df['doi'])
-psyc_orig_df['Title_std'] = standardize_text(psyc_orig_df['title'])
-psyc_orig_df['Authors_std'] = standardize_text(psyc_orig_df['Authors'])
+psyc_orig_df['DOI_std'] = standardize_text_series(psyc_orig_df['doi'])
+psyc_orig_df['Title_std'] = standardize_text_series(psyc_orig_df['title'])
+psyc_orig_df['Authors_std'] = standardize_text_series(psyc_orig_df['Authors'])
 psyc_orig_df['Year_std'] = standardize_year_psyc(psyc_orig_df['publicationDate'])
-psyc_orig_df['Secondary_Key'] = psyc_orig_df['Title_std'].fillna('') + '|' + psyc_orig_df['Authors_std'].fillna('') + '|' + psyc_orig_df['Year_std'].astype(str).fillna('')
+psyc_orig_df['Secondary_Key'] = psyc_orig_df['Title_std'].str.cat(
+    [psyc_orig_df['Authors_std'], psyc_orig_df['Year_std'].astype('string')], sep='|', na_rep='')
+
+# Hash indexes so each fallback lookup is O(1) instead of scanning the frames
+wos_lookup = {
+    'df': wos_orig_df,
+    'by_doi': build_lookup_index(wos_orig_df['DOI_std']),
+    'by_key': build_lookup_index(wos_orig_df['Secondary_Key']),
+}
+psyc_lookup = {
+    'df': psyc_orig_df,
+    'by_doi': build_lookup_index(psyc_orig_df['DOI_std']),
+    'by_key': build_lookup_index(psyc_orig_df['Secondary_Key']),
+}
 
 # --- Initialize Crossref Client --- #
-cr = Crossref()
-log_message("Initialized Crossref client.")
+cr = Crossref(mailto=CROSSREF_MAILTO, ua_string=CROSSREF_UA)
+log_message("Initialized Crossref client (polite pool).")
+
+# --- Prefetch Crossref Metadata in Batches --- #
+# One batched query per ~40 DOIs instead of one HTTP round-trip per paper.
+# 40 keeps the request URL comfortably under Crossref's length limit.
+CROSSREF_BATCH_SIZE = 40
+# Concurrent in-flight batch requests; 5 stays well within polite-pool limits.
+CROSSREF_MAX_WORKERS = 5
+# On-disk cache of Crossref responses so reruns skip already-fetched DOIs
+CROSSREF_CACHE_FILE = '.crossref_cache'
+
+def fetch_crossref_chunk(chunk):
+    """Fetch one batch of DOIs from Crossref, returning {doi: message}."""
+    fetched = {}
+    results = cr.works(ids=chunk)
+    # habanero returns a single dict for one id, a list of dicts for several
+    if isinstance(results, dict):
+        results = [results]
+    for result in results:
+        if result and 'message' in result:
+            message = result['message']
+            result_doi = str(message.get('DOI', '')).lower().strip()
+            if result_doi:
+                fetched[result_doi] = message
+    return fetched
+
+log_message("Prefetching Crossref metadata in concurrent batches...")
+cr_disk_cache = shelve.open(CROSSREF_CACHE_FILE)
+cr_cache = {}
+all_dois = [d for d in dedup_df['DOI'].dropna().unique().tolist()
+            if d and str(d).lower().strip() not in existing_dois]
+# Serve reruns from the on-disk cache; only hit the network for new DOIs
+for doi in all_dois:
+    cache_key = str(doi).lower().strip()
+    if cache_key in cr_disk_cache:
+        cr_cache[cache_key] = cr_disk_cache[cache_key]
+dois_to_fetch = [d for d in all_dois if str(d).lower().strip() not in cr_cache]
+if cr_cache:
+    log_message(f"Loaded {len(cr_cache)} Crossref records from local cache.")
+chunks = [dois_to_fetch[start:start + CROSSREF_BATCH_SIZE]
+          for start in range(0, len(dois_to_fetch), CROSSREF_BATCH_SIZE)]
+with ThreadPoolExecutor(max_workers=CROSSREF_MAX_WORKERS) as executor:
+    future_to_chunk = {executor.submit(fetch_crossref_chunk, chunk): chunk for chunk in chunks}
+    for future in as_completed(future_to_chunk):
+        try:
+            for fetched_doi, message in future.result().items():
+                cr_cache[fetched_doi] = message
+                cr_disk_cache[fetched_doi] = message
+        except Exception as e:
+            chunk = future_to_chunk[future]
+            log_message(f"  WARNING: Batch Crossref query failed for a chunk of {len(chunk)} DOIs: {e}")
+cr_disk_cache.sync()
+log_message(f"Crossref metadata available for {len(cr_cache)} of {len(all_dois)} DOIs.")
+
+# --- Helper: Batched Item Creation --- #
+# The Zotero write API accepts up to 50 items per create_items POST, so
+# templates are buffered and flushed in batches instead of one POST per paper.
+CREATE_BATCH_SIZE = 50
+pending_templates = []
+pending_meta = []  # (paper_id, template_source) parallel to pending_templates
+
+def flush_create_items(zot_client):
+    global added_count, failed_count
+    if not pending_templates:
+        return
+    batch = pending_templates[:]
+    meta = pending_meta[:]
+    del pending_templates[:]
+    del pending_meta[:]
+
+    log_message(f"\n  Flushing batch of {len(batch)} item templates to Zotero...")
+    try:
+        resp = zot_client.create_items(batch)
+        successful = resp.get('successful', {})
+        failed = resp.get('failed', {})
+        for i, (paper_id, template_source) in enumerate(meta):
+            resp_key = str(i)
+            if resp_key in successful and 'key' in successful[resp_key]:
+                added_count += 1
+                log_message(f"    SUCCESS: Paper ID {paper_id} created from {template_source} data. Item Key: {successful[resp_key]['key']}.")
+            elif resp_key in failed and failed[resp_key].get('code') == 412:  # Precondition failed (likely duplicate)
+                failed_count += 1
+                log_message(f"    INFO: Paper ID {paper_id} creation failed (Code 412), likely already exists.")
+            else:
+                failed_count += 1
+                log_message(f"    ERROR: Paper ID {paper_id} creation failed. Failure: {failed.get(resp_key)}")
+    except Exception as e:
+        failed_count += len(meta)
+        log_message(f"    ERROR: Exception during batched Zotero create_items: {e}")
+        import traceback
+        log_message(traceback.format_exc())
+        if "Rate limit" in str(e):
+            delay = backoff_delay(e)
+            log_message(f"  WARNING: Hit Zotero API rate limit during batch creation. Waiting {delay}s. Batch may fail.")
+            time.sleep(delay)
+
+def queue_item_creation(zot_client, template, paper_id, template_source):
+    pending_templates.append(template)
+    pending_meta.append((paper_id, template_source))
+    if len(pending_templates) >= CREATE_BATCH_SIZE:
+        flush_create_items(zot_client)
 
 # --- Process Each Paper --- #
 log_message("\n--- Starting Zotero Item Processing --- (CrossRef -> Zotero ID -> Manual) - v5 ---")
 added_count = 0
 failed_count = 0
+skipped_count = 0
 processed_count = 0
 
-for index, row in dedup_df.iterrows():
+# Iterate plain dicts rather than iterrows(), which builds a Series per row
+for row in dedup_df.to_dict('records'):
     processed_count += 1
     paper_id = row.get('paper_id')
     doi_std = row.get('DOI')
@@ -375,76 +606,66 @@ for index, row in dedup_df.iterrows():
     year_std = row.get('Publication Year')
     log_message(f"\nProcessing Paper ID: {paper_id} ({processed_count}/{len(dedup_df)}), DOI: {doi_std if pd.notna(doi_std) else 'N/A'}, Title: {title_std:.30}...")
 
+    # Skip papers whose DOI is already in the target collection
+    if pd.notna(doi_std) and str(doi_std).lower().strip() in existing_dois:
+        skipped_count += 1
+        log_message("  SKIP: DOI already present in the target collection.")
+        continue
+
     item_key = None
-    item_created_now = False # Track if *this run* created the item
+    item_queued = False # Track if a template was buffered for batched creation
     template_source = None
     zotero_template = None
 
-    # --- Strategy 1: Query CrossRef using DOI --- #
+    # --- Strategy 1: Look up CrossRef data (prefetched cache, network fallback) --- #
     if pd.notna(doi_std) and doi_std:
-        log_message(f"  1. Attempting CrossRef query for DOI: {doi_std}")
-        try:
-            cr_result = cr.works(ids=doi_std)
-            if cr_result and 'message' in cr_result:
-                cr_data = cr_result['message']
-                log_message("    CrossRef query successful.")
-                # Pass collection_id when creating template
-                zotero_template = create_template_from_crossref(cr_data, collection_id)
-                if zotero_template:
-                    template_source = "CrossRef"
-                    log_message("    Created Zotero template (incl. collection) from CrossRef data.")
-                else:
-                     log_message("    WARNING: Could not create template from CrossRef data.")
+        log_message(f"  1. Attempting CrossRef lookup for DOI: {doi_std}", level=logging.DEBUG)
+        cr_data = cr_cache.get(str(doi_std).lower().strip())
+        if cr_data is None:
+            # Cache miss (e.g. the batch query failed) - fall back to a single-DOI call
+            log_message("    DOI not in prefetched cache, querying CrossRef directly...")
+            try:
+                cr_result = cr.works(ids=doi_std)
+                if cr_result and 'message' in cr_result:
+                    cr_data = cr_result['message']
+                    cr_disk_cache[str(doi_std).lower().strip()] = cr_data
+            except Exception as e:
+                log_message(f"    ERROR: Exception during CrossRef query: {e}")
+        if cr_data:
+            log_message("    CrossRef lookup successful.", level=logging.DEBUG)
+            # Pass collection_id when creating template
+            zotero_template = create_template_from_crossref(cr_data, collection_id)
+            if zotero_template:
+                template_source = "CrossRef"
+                log_message("    Created Zotero template (incl. collection) from CrossRef data.", level=logging.DEBUG)
             else:
-                log_message("    WARNING: CrossRef query returned no message data.")
-        except Exception as e:
-            log_message(f"    ERROR: Exception during CrossRef query: {e}")
+                 log_message("    WARNING: Could not create template from CrossRef data.")
+        else:
+            log_message("    WARNING: No CrossRef data available for this DOI.")
 
-    # --- Create Item in Zotero (if template from CrossRef created) --- #
+    # --- Queue Item for Batched Creation (if template from CrossRef created) --- #
     if zotero_template:
-        log_message(f"  Attempting Zotero item creation using template from: {template_source}")
-        try:
-            resp = zot.create_items([zotero_template])
-            log_message(f"    Response from create_items: {resp}")
-            if resp['successful'] and '0' in resp['successful'] and 'key' in resp['successful']['0']:
-                item_key = resp['successful']['0']['key']
-                item_created_now = True
-                log_message(f"    SUCCESS: Item created in Zotero using {template_source} data. Item Key: {item_key}. Added to collection during creation.")
-            elif resp['failed']:
-                 # Handle potential duplicate error if item already exists but wasn't found by Crossref?
-                 if '0' in resp['failed'] and resp['failed']['0']['code'] == 412: # Precondition failed (likely duplicate)
-                     log_message("    INFO: Item creation failed (Code 412), likely already exists. Will try Zotero ID lookup.")
-                 else:
-                     log_message(f"    ERROR: Failed Zotero create_items call. Failure: {resp['failed']}")
-            else:
-                log_message("    ERROR: Unexpected response from Zotero create_items.")
-            zotero_template = None # Reset template
-        except Exception as e:
-             log_message(f"    ERROR: Exception during Zotero create_items: {e}")
-             import traceback
-             log_message(traceback.format_exc())
-             if "Rate limit" in str(e):
-                 log_message(f"  WARNING: Hit Zotero API rate limit during creation. Waiting {rate_limit_delay}s. Item may fail.")
-                 time.sleep(rate_limit_delay)
+        log_message(f"  Queueing Zotero item creation using template from: {template_source}", level=logging.DEBUG)
+        queue_item_creation(zot, zotero_template, paper_id, template_source)
+        item_queued = True
+        zotero_template = None # Reset template
 
     # --- Strategy 2: Zotero Identifier Lookup (if CrossRef failed/skipped and DOI exists) --- #
-    if item_key is None and pd.notna(doi_std) and doi_std:
-        log_message(f"  2. Attempting Zotero identifier lookup for DOI: {doi_std}")
+    if not item_queued and item_key is None and pd.notna(doi_std) and doi_std:
+        log_message(f"  2. Attempting Zotero identifier lookup for DOI: {doi_std}", level=logging.DEBUG)
         try:
             resp = zot.add_items_by_identifier([doi_std])
-            log_message(f"    Response from add_items_by_identifier: {resp}")
+            log_message(f"    Response from add_items_by_identifier: {resp}", level=logging.DEBUG)
             if resp and isinstance(resp, dict) and resp.get('success'):
                 item_key = resp['success'][0]
-                item_created_now = True # Zotero created it now
                 log_message(f"    SUCCESS: Item created via Zotero ID lookup. Item Key: {item_key}. Need to add collection separately if needed.")
                 # Add to collection since it was just created
-                add_existing_item_to_collection(zot, item_key, collection_id, collection_name)
+                queue_collection_add(zot, item_key, collection_id, collection_name)
             elif resp and isinstance(resp, dict) and resp.get('unchanged'):
                  item_key = resp['unchanged'][0]
-                 item_created_now = False # Already existed
                  log_message(f"    INFO: Item already exists in library (unchanged). Item Key: {item_key}. Checking/adding collection.")
                  # Check if it needs adding to collection
-                 add_existing_item_to_collection(zot, item_key, collection_id, collection_name)
+                 queue_collection_add(zot, item_key, collection_id, collection_name)
             elif resp and isinstance(resp, dict) and resp.get('failed'):
                  log_message(f"    WARNING: Zotero ID lookup failed. Reason: {resp['failed']}")
             else:
@@ -454,61 +675,51 @@ for index, row in dedup_df.iterrows():
              import traceback
              log_message(traceback.format_exc())
              if "Rate limit" in str(e):
-                 log_message(f"  WARNING: Hit Zotero API rate limit during ID lookup. Waiting {rate_limit_delay}s. Item may fail.")
-                 time.sleep(rate_limit_delay)
+                 delay = backoff_delay(e)
+                 log_message(f"  WARNING: Hit Zotero API rate limit during ID lookup. Waiting {delay}s. Item may fail.")
+                 time.sleep(delay)
 
     # --- Strategy 3: Manual Creation from Original XLS (if others failed) --- #
-    if item_key is None:
-        log_message("  3. Attempting manual creation using original XLS data...")
-        original_row, source_db = find_original_record(doi_std, title_std, authors_std, year_std, wos_orig_df, psyc_orig_df)
+    if not item_queued and item_key is None:
+        log_message("  3. Attempting manual creation using original XLS data...", level=logging.DEBUG)
+        original_row, source_db = find_original_record(doi_std, title_std, authors_std, year_std, wos_lookup, psyc_lookup)
         if original_row is not None and source_db is not None:
-            log_message(f"    Found original record in: {source_db}")
+            log_message(f"    Found original record in: {source_db}", level=logging.DEBUG)
             # Pass collection_id when creating template
             zotero_template = create_template_from_original(original_row, source_db, collection_id)
             if zotero_template:
                 template_source = f"Original {source_db} XLS"
-                log_message(f"    Created Zotero template (incl. collection) from {template_source} data.")
-                log_message(f"    Attempting Zotero item creation using template from: {template_source}")
-                try:
-                    resp = zot.create_items([zotero_template])
-                    log_message(f"      Response from create_items: {resp}")
-                    if resp['successful'] and '0' in resp['successful'] and 'key' in resp['successful']['0']:
-                        item_key = resp['successful']['0']['key']
-                        item_created_now = True
-                        log_message(f"      SUCCESS: Item created in Zotero using {template_source} data. Item Key: {item_key}. Added to collection during creation.")
-                    elif resp['failed']:
-                         if '0' in resp['failed'] and resp['failed']['0']['code'] == 412: # Precondition failed (likely duplicate)
-                            log_message("    INFO: Item creation failed (Code 412), likely already exists.")
-                            # We could try to FIND the item here, but it's complex. Log failure.
-                         else:
-                             log_message(f"      ERROR: Failed Zotero create_items call. Failure: {resp['failed']}")
-                    else:
-                        log_message("      ERROR: Unexpected response from Zotero create_items.")
-                except Exception as e:
-                     log_message(f"      ERROR: Exception during Zotero create_items: {e}")
-                     import traceback
-                     log_message(traceback.format_exc())
-                     if "Rate limit" in str(e):
-                         log_message(f"  WARNING: Hit Zotero API rate limit during manual creation. Waiting {rate_limit_delay}s. Item may fail.")
-                         time.sleep(rate_limit_delay)
+                log_message(f"    Created Zotero template (incl. collection) from {template_source} data.", level=logging.DEBUG)
+                log_message(f"    Queueing Zotero item creation using template from: {template_source}", level=logging.DEBUG)
+                queue_item_creation(zot, zotero_template, paper_id, template_source)
+                item_queued = True
             else:
                 log_message("    ERROR: Could not create template from original row.")
         else:
             log_message("    ERROR: Failed to find original record for manual creation fallback.")
 
-    # --- Update Counts --- #
-    if item_key:
+    # --- Update Counts (queued items are counted when their batch is flushed) --- #
+    if item_queued:
+        pass
+    elif item_key:
         added_count += 1
     else:
         failed_count += 1
         log_message(f"  FAILURE: Could not process/create/find paper ID {paper_id} via any method.")
 
-    # Optional short delay to be nice to APIs
-    time.sleep(0.6) # Slightly increased delay
+    # Pace API usage: only sleep if the last call was under MIN_CALL_INTERVAL ago
+    throttle()
+
+# --- Flush any remaining batched creations and collection adds --- #
+flush_create_items(zot)
+flush_collection_adds(zot, collection_id, collection_name)
 
 # --- Final Summary --- #
+cr_disk_cache.close()
 log_message(f"\n--- Processing Finished ---")
 log_message(f"Total unique records processed: {processed_count}")
 log_message(f"Successfully processed (created or found): {added_count}")
+log_message(f"Skipped (already in collection): {skipped_count}")
 log_message(f"Failed to process/create: {failed_count}")
-log_message(f"Detailed log saved to: {LOG_FILE}") 
\ No newline at end of file
+log_message(f"Detailed log saved to: {LOG_FILE}")
+_buffer_handler.flush() 
\ No newline at end of file
@@ -1,50 +1,38 @@
 import pandas as pd
-import math
 
 INPUT_CSV = 'merged_papers.csv'
 OUTPUT_RIS = 'zotero_import.ris'
 
-def format_ris_entry(row):
-    ris_entry = []
-    ris_entry.append("TY  - JOUR") # Assuming all are journal articles
+def build_ris_entries(df):
+    """Build one RIS entry per row using whole-column string operations.
 
-    # Handle Authors (split by semicolon, one AU per author)
-    authors = row.get('Authors', '')
-    if isinstance(authors, str):
-        author_list = [a.strip() for a in authors.split(';') if a.strip()]
-        for author in author_list:
-            ris_entry.append(f"AU  - {author}")
+    Each tag is computed as a vectorized Series; missing fields become empty
+    strings so their lines simply drop out of the final concatenation.
+    """
+    # Handle Authors (split by semicolon, one AU line per author)
+    authors = df['Authors'].fillna('').astype(str).str.split(';').explode().str.strip()
+    authors = authors[authors != '']
+    au_block = ('AU  - ' + authors).groupby(level=0).agg('\n'.join) + '\n'
+    au_block = au_block.reindex(df.index, fill_value='')
 
     # Handle Title
-    title = row.get('Article Title', '')
-    if pd.notna(title) and title:
-        ris_entry.append(f"TI  - {title}")
+    title = df['Article Title'].fillna('').astype(str)
+    ti_block = ('TI  - ' + title + '\n').where(title != '', '')
 
-    # Handle Journal Name (Source Title)
-    journal = row.get('Source Title', '')
-    if pd.notna(journal) and journal:
-        ris_entry.append(f"T2  - {journal}") # T2 or JO - T2 is often better for secondary title (journal)
+    # Handle Journal Name (T2 is often better than JO for the secondary title)
+    journal = df['Source Title'].fillna('').astype(str)
+    t2_block = ('T2  - ' + journal + '\n').where(journal != '', '')
 
-    # Handle Publication Year
-    year = row.get('Publication Year')
-    # Check if year is not NaN/NaT and can be converted to int
-    if pd.notna(year):
-        try:
-            # Convert potential float/Int64 to int, then string
-            year_int = int(year)
-            ris_entry.append(f"PY  - {year_int}")
-        except (ValueError, TypeError):
-            pass # Skip if year cannot be converted to int
+    # Handle Publication Year (skip values that cannot be parsed as integers)
+    year = pd.to_numeric(df['Publication Year'], errors='coerce').astype('Int64')
+    py_block = ('PY  - ' + year.astype(str) + '\n').where(year.notna(), '')
 
     # Handle DOI
-    doi = row.get('DOI', '')
-    if pd.notna(doi) and doi:
-        ris_entry.append(f"DO  - {doi}")
+    doi = df['DOI'].fillna('').astype(str)
+    do_block = ('DO  - ' + doi + '\n').where(doi != '', '')
 
-    # End record marker
-    ris_entry.append("ER  - ")
-
-    return "\n".join(ris_entry)
+    # Assume all records are journal articles
+    return 'TY  - JOUR\n' + au_block + ti_block + t2_block + py_block + do_block + 'ER  - '
 
 
 print(f"Loading data from {INPUT_CSV}...")
@@ -59,12 +47,8 @@ except Exception as e:
     exit()
 
 print(f"Generating RIS data for {OUTPUT_RIS}...")
-ris_output = []
-for index, row in df.iterrows():
-    ris_output.append(format_ris_entry(row))
-
 # Join all entries with an extra newline between records
-full_ris_content = "\n\n".join(ris_output)
+full_ris_content = "\n\n".join(build_ris_entries(df).tolist())
 
 print(f"Saving RIS file to {OUTPUT_RIS}...")
 try:
@@ -74,4 +58,4 @@ try:
 except Exception as e:
     print(f"Error writing RIS file: {e}")
 
-print("Script finished.") 
\ No newline at end of file
+print("Script finished.")
@@ -1,20 +1,21 @@
 import pandas as pd
 
 try:
-    # Load the datasets
-    wos_df = pd.read_excel('WebOfScience.xls')
-    psyc_df = pd.read_excel('PsycInfo.xls')
+    # Load only the header and first 5 rows; this script exists for quick
+    # inspection, so there is no reason to parse the whole workbooks
+    wos_df = pd.read_excel('WebOfScience.xls', nrows=5)
+    psyc_df = pd.read_excel('PsycInfo.xls', nrows=5)
 
     # Print header and first 5 rows for Web of Science
     print("--- WebOfScience.xls ---")
     print("Columns:", wos_df.columns.tolist())
     print("\nHead:")
-    print(wos_df.head().to_string()) # Use to_string to prevent truncation
+    print(wos_df.to_string()) # Use to_string to prevent truncation
 
     print("\n\n--- PsycInfo.xls ---")
     print("Columns:", psyc_df.columns.tolist())
     print("\nHead:")
-    print(psyc_df.head().to_string()) # Use to_string to prevent truncation
+    print(psyc_df.to_string()) # Use to_string to prevent truncation
 
 except FileNotFoundError as e:
     print(f"Error: {e}. Make sure the files 'WebOfScience.xls' and 'PsycInfo.xls' are in the same directory.")
